@@ -1,11 +1,29 @@
-from typing import Optional, List, Dict, Type, Generator, Union
+from typing import Optional, List, Dict, Type, Generator, Union, FrozenSet, Tuple, ContextManager
 import os
 import zipfile
+import contextlib
+from pathlib import PurePath
 import re
 import csv
+import operator
+import zlib
+from xml.parsers.expat import ExpatError
 from xml_wrapper import XMLWrapper
 
 
+#Errors raised when reading or parsing an XML file within a damaged, encrypted
+#or otherwise unsupported OOX file. These come from the file's content, so
+#won't go away on retrying; I/O errors (OSError) aren't included.
+_READ_ERRORS = (
+        zipfile.BadZipFile,
+        EOFError, #Truncated member.
+        zlib.error,
+        NotImplementedError, #Unsupported compression method.
+        RuntimeError, #Encrypted member.
+        ExpatError,
+        )
+
+
 class GenericParser:
     """
     This class contains methods for reading data from an Office Open XML (OOX)
@@ -14,22 +32,84 @@ class GenericParser:
 
     Init Parameters:
       - filepath: The path to the OOX file.
+
+    Class Attributes:
+      - archive_class: The class used to open the OOX (zip) file. Defaults to
+        zipfile.ZipFile; may be overridden in a subclass with any drop-in
+        replacement (same constructor, namelist, open and context manager
+        support) backed by a faster decompressor.
+      - file_extensions: The (lowercase) file extensions this parser handles.
+        When a ParserCollection walks a directory, only files with one of these
+        extensions are parsed.
+
+    Instances use __slots__ to keep per-document memory down in large
+    collections; subclasses should declare __slots__ for any attrs they add.
     """
 
+    __slots__ = (
+            'filepath',
+            'filename',
+            'filename_base',
+            'filename_ext',
+            'text_node_tag',
+            'special_tags',
+            'ignore_tags',
+            '_zip',
+            '_xml_names',
+            '_parsed',
+            )
+
+    archive_class = zipfile.ZipFile
+    file_extensions = (
+            '.docx', '.docm', '.dotx', '.dotm',
+            '.xlsx', '.xlsm', '.xltx', '.xltm',
+            '.pptx', '.pptm', '.potx', '.potm', '.ppsx', '.ppsm',
+            )
+
     def __init__(
             self,
             filepath: str,
             ):
         self.filepath = filepath
-        self.filename = os.path.basename(self.filepath)
-        self.filename_base, self.filename_ext = os.path.splitext(self.filename)
+        path = PurePath(self.filepath)
+        self.filename = path.name
+        self.filename_base = path.stem
+        self.filename_ext = path.suffix
         self.text_node_tag = 'w:t'
         self.special_tags = {}
+        self.ignore_tags = ()
         
-        self._xml_files = {}
-        with zipfile.ZipFile(self.filepath) as z:
-            for xml_filename in [x for x in z.namelist() if x.endswith('.xml')]:
-                self._xml_files[xml_filename] = None
+        self._zip = self.archive_class(self.filepath)
+        self._xml_names = frozenset(
+                x for x in self._zip.namelist() if x.endswith('.xml')
+                )
+        self._parsed = {} #Failed parses are kept as None.
+
+    def __enter__(self) -> 'GenericParser':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the underlying OOX (zip) file. Any XML files already parsed remain
+        available; if another one is requested, the OOX file is opened just long
+        enough to read it, so a closed parser never holds a file open.
+        """
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def _archive(self) -> ContextManager[zipfile.ZipFile]:
+        """
+        Provides the OOX (zip) file for reading a member: the parser's own handle
+        while it's open (left open on exit), or a temporary one after close()
+        (closed on exit).
+        """
+        if self._zip is not None:
+            return contextlib.nullcontext(self._zip)
+        return self.archive_class(self.filepath)
 
     def xml_file(
             self,
@@ -38,30 +118,77 @@ class GenericParser:
         """
         Fetches an XMLWrapper instance for the given XML file contained within the
         document. Will return an existing instance of one already exists, or open
-        and parse a new one otherwise. The DOM will always be reset to root.
+        and parse a new one otherwise. Each XML file is read and parsed at most
+        once per document, even if parsing fails (errors opening the document
+        itself, e.g. too many open files, propagate instead and aren't
+        remembered). The DOM will always be reset to root.
 
         Parameters:
           - xml_filename: The path (relative to the document root) of the XML file.
         Return: The XMLWrapper instance; None on failure.
         """
+        if xml_filename not in self._parsed: #Not parsed yet.
+            if xml_filename not in self._xml_names:
+                return None
+            with self._archive() as z: #Errors opening it aren't remembered.
+                try:
+                    with z.open(xml_filename) as f:
+                        xml = XMLWrapper.from_stream(
+                                f,
+                                self.text_node_tag,
+                                self.special_tags,
+                                self.ignore_tags,
+                                )
+                except _READ_ERRORS:
+                    xml = None #Remember the failure rather than reparsing.
+            self._parsed[xml_filename] = xml
+        xml = self._parsed[xml_filename]
+        return xml.reset_to_root() if xml is not None else None
+
+    def search_xml_file(
+            self,
+            xml_filename: str,
+            pattern: Union[str, re.Pattern],
+            ) -> Optional[str]:
+        """
+        Streams the given XML file contained within the document in search of
+        the first text node matching a regex pattern, without parsing it into a
+        DOM (and stopping once a match is found). Useful for cheap checks, e.g.
+        whether a document is of a certain kind, before doing any real parsing.
+
+        Parameters:
+          - xml_filename: The path (relative to the document root) of the XML file.
+          - pattern: The regex pattern to search for, as a str or compiled.
+        Return: The text of the matching node; None if no match or on failure.
+        """
+        if xml_filename not in self._xml_names:
+            return None
         try:
-            if self._xml_files[xml_filename] is None:
-                with zipfile.ZipFile(self.filepath) as z:
-                    self._xml_files[xml_filename] = XMLWrapper(
-                            z.read(xml_filename),
-                            self.text_node_tag,
-                            self.special_tags,
-                            )
-            return self._xml_files[xml_filename].reset_to_root()
-        except:
+            with self._archive() as z, z.open(xml_filename) as f:
+                return XMLWrapper.search_stream(f, pattern, self.text_node_tag)
+        except _READ_ERRORS:
             return None
 
+    def release_xml_files(self) -> None:
+        """
+        Discards the DOMs of any XML files parsed so far so that their memory can
+        be reclaimed, e.g. once all needed data has been extracted from them.
+        They will be parsed again if requested later.
+        """
+        self._parsed = { #Keep remembering failures.
+                x: xml for x, xml in self._parsed.items() if xml is None
+                }
+
     @property
-    def xml_files(self) -> List[str]:
-        return self._xml_files.keys()
+    def xml_files(self) -> FrozenSet[str]:
+        return self._xml_names
 
 
 class WordProcessingParser(GenericParser):
+    __slots__ = ()
+
+    file_extensions = ('.docx', '.docm', '.dotx', '.dotm')
+
     def __init__(
             self,
             filepath: str,
@@ -71,16 +198,21 @@ class WordProcessingParser(GenericParser):
                 )
         self.text_node_tag = 'w:t'
         self.special_tags = {
-                'w:tab': lambda n: "\t" if n.toxml() == '<w:tab/>' else '',
+                #A bare w:tab is a tab character; one with attrs is a tab stop.
+                'w:tab': lambda n: '' if n.hasAttributes() else "\t",
                 }
 
 
 class SpreadsheetParser(GenericParser):
-    pass
+    __slots__ = ()
+
+    file_extensions = ('.xlsx', '.xlsm', '.xltx', '.xltm')
 
 
 class PresentationParser(GenericParser):
-    pass
+    __slots__ = ()
+
+    file_extensions = ('.pptx', '.pptm', '.potx', '.potm', '.ppsx', '.ppsm')
 
 
 class ParserCollection:
@@ -90,36 +222,77 @@ class ParserCollection:
 
     Init Parameters:
       - parser: The class of parser to use (GenericParser or a derivative).
-      - files: If str: a directory to be traversed (including subdirs) for
-        files to parse. If list: a list of filenames to be parsed.
+      - files: If str or path-like: a directory to be traversed (including
+        subdirs) for files to parse; only files matching the parser's
+        file_extensions are included, and Office lock files (~$*) are skipped.
+        If list: a list of filenames to be parsed.
       - output_props: Optional. A List[str], the name(s) of the parser
         named attrs which will be output by the various output methods here.
       - output_props_extended: Optional. A Dict[str, List[str]. The keys
         should be the names of attrs within the parser, each of which is a
         List[Dict[str, Any]]. This is used for the extended output
         methods here.
+      - max_workers: Optional. The number of threads used to parse the files
+        concurrently. When None (default), one per available CPU is used.
+        Set to 1 to parse the files serially.
     """
 
     def __init__(
             self,
             parser: Type[GenericParser],
-            files: Union[str, List[str]],
+            files: Union[str, os.PathLike, List[str]],
             output_props: List[str] = [],
             output_props_extended: Dict[str, List[str]] = {},
+            max_workers: Optional[int] = None,
             ):
         self.parser = parser
         self.docs = {}
         self._next_key = 0
-        if type(files) == str: #Walk the directory.
-            for (path, dirnames, filenames) in os.walk(files):
-                for filename in filenames:
-                    self.add_file(os.path.join(path, filename))
+        if isinstance(files, (str, os.PathLike)): #Walk the directory.
+            filepaths = list(ParserCollection._walk_files(
+                    os.fspath(files),
+                    parser.file_extensions,
+                    ))
         else: #Handle the list of filepaths.
-            for filepath in files:
-                self.add_file(filepath)
+            filepaths = list(files)
+        self.add_files(filepaths, max_workers)
         self.output_props = output_props
         self.output_props_extended = output_props_extended
 
+    @staticmethod
+    def _walk_files(
+            path: str,
+            extensions: Tuple[str, ...],
+            ) -> Generator[str, None, None]:
+        """
+        Recursively finds the files within a directory which have one of the
+        given extensions, skipping Office lock files. The DirEntry objects from
+        os.scandir already carry each file's name, full path and (on most
+        platforms) its type, so no extra stat call or path join is needed per
+        file.
+
+        Parameters:
+          - path: The directory to traverse.
+          - extensions: The (lowercase) file extensions to include.
+        Return: Generator, each iteration yielding the path of a file.
+        """
+        filepaths = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        if entry.name.lower().endswith(extensions) \
+                                and not entry.name.startswith('~$'):
+                            filepaths.append(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+        except OSError: #Skip missing/unreadable dirs, as os.walk does.
+            return
+        yield from filepaths
+        for subdir in subdirs:
+            yield from ParserCollection._walk_files(subdir, extensions)
+
     def add_file(
             self,
             filepath: str,
@@ -130,9 +303,54 @@ class ParserCollection:
         Parameters:
           - filepath: The path to the file.
         """
-        self.docs[self._next_key] = self.parser(filepath)
+        self.docs[self._next_key] = self._load(filepath)
         self._next_key += 1
 
+    def _load(
+            self,
+            filepath: str,
+            ) -> GenericParser:
+        """
+        Parses a file and closes its OOX (zip) file, so that a large collection
+        doesn't hold a file descriptor open per document. Any more XML files
+        requested later are read by briefly reopening it.
+
+        Parameters:
+          - filepath: The path to the file.
+        Return: The parser instance.
+        """
+        doc = self.parser(filepath)
+        doc.close()
+        return doc
+
+    def add_files(
+            self,
+            filepaths: List[str],
+            max_workers: Optional[int] = None,
+            ) -> None:
+        """
+        Add several new files to the collection, parsing them concurrently.
+        Keys are assigned in the order the filepaths are given.
+
+        Parameters:
+          - filepaths: The paths to the files.
+          - max_workers: Optional. The number of threads to parse with. When
+            None (default), one per available CPU is used.
+        """
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers == 1 or len(filepaths) < 2: #Not worth a pool.
+            for filepath in filepaths:
+                self.add_file(filepath)
+            return
+        #Deferred, as it's comparatively slow to import (it pulls in logging
+        #and threading) and only needed when actually parsing concurrently.
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for doc in ex.map(self._load, filepaths):
+                self.docs[self._next_key] = doc
+                self._next_key += 1
+
     def output_data(
             self,
             **kwargs,
@@ -175,12 +393,19 @@ class ParserCollection:
                 extended_attr: str = None,
                 ):
             self.parser_collection = parser_collection
-            if not props:
-                if not extended_attr:
-                    self.props = parser_collection.output_props
-                else:
-                    self.props = parser_collection.output_props_extended[extended_attr]
+            if props:
+                self.props = props
+            elif not extended_attr:
+                self.props = parser_collection.output_props
+            else:
+                self.props = parser_collection.output_props_extended[extended_attr]
             self.extended_attr = extended_attr
+            #Work out which fields come from the doc/record once, rather than
+            #once per doc, and fetch doc attrs with a single C-level getter.
+            key_field = 'doc_key' if extended_attr else 'key'
+            self._fields = tuple(p for p in self.props if p != key_field)
+            self._getter = operator.attrgetter(*self._fields) \
+                    if self._fields else lambda doc: ()
 
         @property
         def field_list(
@@ -204,29 +429,26 @@ class ParserCollection:
             the parser's related attrs as values. Each dict includes a "key" value
             (when not in extended mode) or a "doc_key" value (when in extended mode).
             """
-            props = self.props
             extended_attr = self.extended_attr
+            fields = self._fields
+            getter = self._getter
+            single_field = len(fields) == 1 #attrgetter returns a bare value
             for key, doc in self.parser_collection.docs.items():
                 key = getattr(doc, 'key', key) #Use the parser's key attr if it has it
                 if not extended_attr: #Fetch doc attrs (non-extended mode)
                     try:
-                        output = {}
-                        output['key'] = key
-                        for prop in [p for p in props if p != 'key']:
-                            output[prop] = getattr(doc, prop, None)
-                        yield output
-                    except:
-                        continue
+                        values = getter(doc)
+                        if single_field:
+                            values = (values,)
+                    except AttributeError: #Default any missing attrs to None
+                        values = [getattr(doc, p, None) for p in fields]
+                    yield {'key': key, **dict(zip(fields, values))}
                 else: #Fetch 0 or more records from a single doc attr (extended mode)
-                    try:
-                        for record in getattr(doc, extended_attr, []): #Empty list default to prevent error
-                            output = {}
-                            output['doc_key'] = key
-                            for prop in [p for p in props if p != 'doc_key']:
-                                output[prop] = record[prop] if prop in record else None
-                            yield output
-                    except:
-                        continue
+                    for record in getattr(doc, extended_attr, None) or []:
+                        yield {
+                                'doc_key': key,
+                                **{p: record.get(p) for p in fields},
+                                }
 
     def output_csv(
             self,
@@ -245,7 +467,7 @@ class ParserCollection:
         Return: self, for the purposes of chaining multiple outputs together.
         """
         try:
-            with open(filename, 'w', newline='') as f:
+            with open(filename, 'w', newline='', buffering=1 << 20) as f:
                 data = self.output_data(**kwargs)
                 c = csv.DictWriter(f, data.field_list)
                 c.writeheader()
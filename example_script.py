@@ -3,7 +3,9 @@
 
 
 from doc_parser import WordProcessingParser, ParserCollection
-from typing import Optional, Generator, List, Dict
+from typing import Optional, Generator, List, Dict, Any
+from xml.dom import minidom
+from xml_wrapper import XMLWrapper
 import os
 import re
 import csv
@@ -16,7 +18,23 @@ CSV_RESPS = 'output_resps.csv'
 
 
 class SOP(WordProcessingParser):
+    __slots__ = ('doc_number', 'doc_name', '_extracted')
+
+    _document_xml = 'word/document.xml'
+    _header_xml = 'word/header1.xml'
+
     _re_doc_match = re.compile(r'^(?P<num>[.A-Z]+-\d+), (?P<name>.*)$')
+    _re_issued_by = re.compile(r'^Issued By:?\w*$')
+    _re_sections = re.compile(
+            r'^(?:(?P<references>References?)'
+            r'|(?P<responsibilities>Responsibilit(?:y|ies))):?\w*$'
+            )
+    _re_reference = re.compile(
+            r'^\t?(?P<doc_number>[-.A-Z0-9]+)\t(?P<description>[^\t]+)$'
+            )
+    _re_responsibility = re.compile(
+            r'^\t?(?P<party>[A-Za-z0-9, ]+)\t(?P<responsibilities>[^\t]+)$'
+            )
 
     def __init__(
             self,
@@ -25,99 +43,114 @@ class SOP(WordProcessingParser):
         super().__init__(
                 filepath,
                 )
+        # Formatting properties are never searched or navigated, so don't
+        # spend memory building them into the DOM.
+        self.ignore_tags = ('w:pPr', 'w:rPr', 'w:tblPr', 'w:trPr', 'w:tcPr')
         
         # Extract the document name and number.
         re_doc_match = SOP._re_doc_match.match(self.filename_base)
         self.doc_number = re_doc_match.group('num') if re_doc_match else None
         self.doc_name = re_doc_match.group('name') if re_doc_match else None
 
+        # Do all of the XML work up front, so that it happens in the
+        # ParserCollection's worker threads rather than later during output.
+        self._extracted = self._extract()
+        self.close()
+
     @property
     def is_sop(
             self,
             ) -> bool:
-        try:
-            return self.issued_by is not None
-        except:
-            return None
+        return self.issued_by is not None
 
     @property
     def issued_by(
             self,
             ) -> Optional[str]:
-        try:
-            return self.xml_file('word/header1.xml') \
-                    .set_text_node_by_pattern(r'^Issued By:?\w*$') \
-                    .set_ancestor_node_by_tag('w:tc') \
-                    .set_nextSibling() \
-                    .get_text_value()
-        except:
-            return None
+        return self._extracted['issued_by']
 
     @property
     def has_references(
             self,
             ) -> bool:
-        try:
-            return self.xml_file('word/document.xml') \
-                    .set_text_node_by_pattern(r'^References?:?\w*$') \
-                    is not None
-        except:
-            return None
+        return self._extracted['has_references']
 
     @property
     def references(
             self,
             ) -> List[Dict[str, str]]:
-        refs = []
-        try:
-            r = re.compile(r'^\t?(?P<num>[-.A-Z0-9]+)\t(?P<desc>[^\t]+)$')
-            n = self.xml_file('word/document.xml') \
-                    .set_text_node_by_pattern(r'^References?:?\w*$') \
-                    .set_ancestor_node_by_tag('w:p')
-            while n.set_nextSibling():
-                re_match = r.match(n.get_text_value())
-                if not re_match: #No match means it's time to stop parsing
-                    break
-                refs.append({
-                    'doc_number': re_match.group('num'),
-                    'description': re_match.group('desc'),
-                    })
-            return refs
-        except:
-            return refs
+        return self._extracted['references']
 
     @property
     def has_responsibilities(
             self,
             ) -> bool:
-        try:
-            return self.xml_file('word/document.xml') \
-                    .set_text_node_by_pattern(r'^Responsibilit(y|ies):?\w*$') \
-                    is not None
-        except:
-            return None
+        return self._extracted['has_responsibilities']
 
     @property
     def responsibilities(
             self,
-            ) -> bool:
-        resps = []
-        try:
-            r = re.compile(r'^\t?(?P<party>[A-Za-z0-9, ]+)\t(?P<resp>[^\t]+)$')
-            n = self.xml_file('word/document.xml') \
-                    .set_text_node_by_pattern(r'^Responsibilit(y|ies):?\w*$') \
-                    .set_ancestor_node_by_tag('w:p')
-            while n.set_nextSibling():
-                re_match = r.match(n.get_text_value())
-                if not re_match: #No match means it's time to stop parsing
-                    break
-                resps.append({
-                    'party': re_match.group('party'),
-                    'responsibilities': re_match.group('resp'),
-                    })
-            return resps
-        except:
-            return resps
+            ) -> List[Dict[str, str]]:
+        return self._extracted['responsibilities']
+
+    def _extract(
+            self,
+            ) -> Dict[str, Any]:
+        # Pull everything needed out of the XML in one go, keeping only the
+        # extracted values; the DOMs are then released to free their memory.
+        extracted = {'issued_by': self._extract_issued_by()}
+        n = self.xml_file(SOP._document_xml)
+        # Locate every section heading in a single pass over the document.
+        section_nodes = n.get_text_nodes_by_pattern(SOP._re_sections) \
+                if n is not None else None
+        for section, r in (
+                ('references', SOP._re_reference),
+                ('responsibilities', SOP._re_responsibility),
+                ):
+            if section_nodes is None:
+                extracted['has_' + section] = None
+                extracted[section] = []
+            else:
+                extracted['has_' + section] = section in section_nodes
+                extracted[section] = SOP._extract_rows(
+                        n,
+                        section_nodes.get(section),
+                        r,
+                        )
+        self.release_xml_files()
+        return extracted
+
+    def _extract_issued_by(
+            self,
+            ) -> Optional[str]:
+        n = self.xml_file(SOP._header_xml)
+        if n is None \
+                or n.set_text_ancestor_node_by_pattern(
+                        SOP._re_issued_by,
+                        'w:tc',
+                        ) is None \
+                or n.set_nextSibling() is None:
+            return None
+        return n.get_text_value()
+
+    @staticmethod
+    def _extract_rows(
+            n: XMLWrapper,
+            heading: Optional[minidom.Node],
+            r: re.Pattern,
+            ) -> List[Dict[str, str]]:
+        # Collect the paragraphs following a section heading for as long as
+        # they match the pattern, each as a dict of the pattern's named groups.
+        rows = []
+        if n.set_node(heading) is None \
+                or n.set_ancestor_node_by_tag('w:p') is None:
+            return rows
+        while n.set_nextSibling():
+            re_match = r.match(n.get_text_value())
+            if not re_match: #No match means it's time to stop parsing
+                break
+            rows.append(re_match.groupdict())
+        return rows
 
 
 if __name__ == '__main__':
@@ -1,6 +1,15 @@
-from typing import Optional, Dict, Union, Callable
+from typing import Optional, Dict, Union, Callable, Iterable, BinaryIO, Generator, Tuple
+import functools
 import re
-from xml.dom import minidom
+from xml.dom import minidom, expatbuilder, xmlbuilder, NodeFilter
+from xml.parsers import expat
+
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+_TEXT_NODE = minidom.Node.TEXT_NODE
+_ELEMENT_NODE = minidom.Node.ELEMENT_NODE
+_CDATA_SECTION_NODE = minidom.Node.CDATA_SECTION_NODE
+_TEXT_CACHE_MIN_NODES = 6
 
 
 class XMLWrapper:
@@ -8,52 +17,204 @@ class XMLWrapper:
     This class adds some functionality to the existing xml.dom.minidom class.
 
     Init parameters:
-      - xml_contents: A str containing the XML to be parsed.
+      - xml_contents: A str or bytes containing the XML to be parsed. Bytes
+        (e.g. as read from a zip file) are preferred, being handed to the
+        parser as-is rather than first having to be decoded into a str.
       - text_node_tag = 'w:t': Optional. The XML tag name for nodes expected to
         contain text.
       - special_tags: Optional. Tags with special meaning, such as w:tab being
         equivalent to \\t. Dict with keys tagnames and values text to sub, or
         values can also be callables which get passed the node and return text
         to sub.
+      - ignore_tags: Optional. Tags to be dropped (along with everything inside
+        them) while parsing, such as formatting properties which will never be
+        navigated to or searched. Each is discarded as soon as it has been
+        parsed, which reduces both the memory held by the DOM and the number of
+        nodes later traversed.
+
+    The methods which search by regex pattern accept either a str (compiled
+    once and cached) or an already compiled re.Pattern. When the same pattern
+    is used for many documents, compiling it once up front (e.g. as a module or
+    class constant) and passing that is the cheapest option.
+
+    Instances use __slots__ (one wrapper is created per XML file parsed, and
+    self.node is read on every navigation), so only the attrs declared there
+    can be set; subclasses should declare __slots__ for any attrs they add.
     """
 
+    __slots__ = (
+            'minidom',
+            'text_node_tag',
+            'special_tags',
+            'node',
+            '_text_cache',
+            '_text_nodes_cache',
+            )
+
     def __init__(
             self,
-            xml_contents: str,
+            xml_contents: Union[str, bytes],
             text_node_tag: Optional[str] = 'w:t',
-            special_tags: Optional[Dict[str, Union[str, Callable]]] = {}
+            special_tags: Optional[Dict[str, Union[str, Callable]]] = {},
+            ignore_tags: Optional[Iterable[str]] = None,
             ):
-        self.minidom = minidom.parseString(xml_contents)
+        self._setup(
+                _builder(ignore_tags).parseString(xml_contents),
+                text_node_tag,
+                special_tags,
+                )
+
+    @classmethod
+    def from_stream(
+            cls,
+            stream: BinaryIO,
+            text_node_tag: Optional[str] = 'w:t',
+            special_tags: Optional[Dict[str, Union[str, Callable]]] = {},
+            ignore_tags: Optional[Iterable[str]] = None,
+            ) -> 'XMLWrapper':
+        """
+        An alternate constructor which parses the XML from a file-like object
+        (e.g. a member opened from a zip file) as it is read, rather than from
+        a str already held in memory in its entirety.
+
+        Parameters:
+          - stream: The file-like object containing the XML to be parsed.
+          - text_node_tag, special_tags, ignore_tags: See the class.
+        Return: The new XMLWrapper instance.
+        """
+        xml = cls.__new__(cls)
+        xml._setup(
+                _builder(ignore_tags).parseFile(stream),
+                text_node_tag,
+                special_tags,
+                )
+        return xml
+
+    @staticmethod
+    def precompile(
+            patterns: Iterable[str],
+            ) -> None:
+        """
+        Compiles regex patterns ahead of time (e.g. at startup, for the patterns
+        every document will be searched with), so that the pattern methods here
+        find them already compiled.
+
+        Parameters:
+          - patterns: The regex patterns to compile.
+        """
+        for pattern in patterns:
+            _compile(pattern)
+
+    @staticmethod
+    def search_stream(
+            stream: BinaryIO,
+            pattern: Union[str, re.Pattern],
+            text_node_tag: Optional[str] = 'w:t',
+            ) -> Optional[str]:
+        """
+        Finds the text of the first XML text node whose value matches the supplied
+        regex pattern, reading the XML from a file-like object. No DOM is built,
+        and reading stops soon after a match is found, so this is much cheaper
+        than parsing when only the presence (or text) of a match is needed.
+
+        Parameters:
+          - stream: The file-like object containing the XML to be searched.
+          - pattern: The regex pattern to search for, as a str or compiled.
+          - text_node_tag = 'w:t': Optional. See the class.
+        Return: The text of the matching node; None if there is no match.
+        """
+        r = pattern if isinstance(pattern, re.Pattern) else _compile(pattern)
+        found = []
+        text = None #The text of the current text node, while inside one.
+
+        def start_element(name, attributes):
+            nonlocal text
+            if name == text_node_tag:
+                text = []
+
+        def end_element(name):
+            nonlocal text
+            if name == text_node_tag and text is not None:
+                if not found and r.search(''.join(text)):
+                    found.append(''.join(text))
+                text = None
+
+        def character_data(data):
+            if text is not None:
+                text.append(data)
+
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        while not found:
+            chunk = stream.read(_STREAM_CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+        return found[0] if found else None
+
+    def _setup(
+            self,
+            dom: minidom.Document,
+            text_node_tag: Optional[str],
+            special_tags: Optional[Dict[str, Union[str, Callable]]],
+            ) -> None:
+        self.minidom = dom
         self.text_node_tag = text_node_tag
         self.special_tags = special_tags
-        self.reset_to_root()
+        self._text_cache = {}
+        self._text_nodes_cache = None
+        self.node = dom
 
     def reset_to_root(
             self,
-            ) -> Optional['XMLWrapper']:
+            ) -> 'XMLWrapper':
         """
         Resets the current target node to the document's root.
 
-        Return: This object, ready to call additional methods; None on failure.
+        Return: This object, ready to call additional methods.
         """
-        try:
-            self.node = self.minidom
-            return self
-        except:
+        self.node = self.minidom
+        return self
+
+    def detach(
+            self,
+            ) -> Optional['XMLWrapper']:
+        """
+        Makes a copy of the current node (and everything within it) the new root
+        of the DOM, and lets go of the rest of the original DOM. Useful when only
+        a small part of a large document is still needed, so that the memory
+        used by the rest can be reclaimed. Nodes from the original DOM which are
+        held elsewhere remain valid, but are no longer part of this DOM.
+
+        Return: This object, ready to call additional methods; None on failure
+        (the current node isn't an element).
+        """
+        if self.node.nodeType != _ELEMENT_NODE:
             return None
+        dom = minidom.getDOMImplementation().createDocument(None, None, None)
+        dom.appendChild(dom.importNode(self.node, True))
+        self._setup(dom, self.text_node_tag, self.special_tags)
+        return self
 
     def set_node(
             self,
             node: minidom.Node,
-            ) -> 'XMLWrapper':
+            ) -> Optional['XMLWrapper']:
         """
         Sets the target node.
 
         Parameters:
           - node: The node to be set.
-        Return: This object, ready to call additional methods.
+        Return: This object, ready to call additional methods; None on failure
+        (no node given).
         """
+        if node is None:
+            return None
         self.node = node
+        return self
 
     def set_firstChild(
             self,
@@ -63,11 +224,11 @@ class XMLWrapper:
 
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            self.node = self.node.firstChild
-            return self
-        except:
+        n = self.node.firstChild
+        if n is None:
             return None
+        self.node = n
+        return self
 
     def set_lastChild(
             self,
@@ -77,11 +238,11 @@ class XMLWrapper:
 
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            self.node = self.node.lastChild
-            return self
-        except:
+        n = self.node.lastChild
+        if n is None:
             return None
+        self.node = n
+        return self
 
     def set_childNode(
             self,
@@ -94,11 +255,11 @@ class XMLWrapper:
           - nth: The index of the child node to set.
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            self.node = self.node.childNodes[nth]
-            return self
-        except:
+        child_nodes = self.node.childNodes
+        if not -len(child_nodes) <= nth < len(child_nodes):
             return None
+        self.node = child_nodes[nth]
+        return self
 
     def set_parentNode(
             self,
@@ -108,11 +269,11 @@ class XMLWrapper:
 
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            self.node = self.node.parentNode
-            return self
-        except:
+        n = self.node.parentNode
+        if n is None:
             return None
+        self.node = n
+        return self
 
     def set_nextSibling(
             self,
@@ -122,11 +283,11 @@ class XMLWrapper:
 
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            self.node = self.node.nextSibling
-            return self
-        except:
+        n = self.node.nextSibling
+        if n is None:
             return None
+        self.node = n
+        return self
 
     def set_previousSibling(
             self,
@@ -136,33 +297,148 @@ class XMLWrapper:
 
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            self.node = self.node.previousSibling
-            return self
-        except:
+        n = self.node.previousSibling
+        if n is None:
             return None
+        self.node = n
+        return self
+
+    def _text_nodes(
+            self,
+            ) -> Iterable[Tuple[minidom.Element, str]]:
+        """
+        Finds the XML text nodes (with their text) below the current node, for
+        the pattern searches. When searching from the root, they are collected
+        once per document and reused, since several searches are commonly made
+        against the same document.
+
+        Return: Iterable of (text node, its text) tuples, in document order.
+        """
+        if self.node is not self.minidom:
+            return _iter_text_nodes(self.node, self.text_node_tag)
+        if self._text_nodes_cache is None:
+            self._text_nodes_cache = list(
+                    _iter_text_nodes(self.minidom, self.text_node_tag)
+                    )
+        return self._text_nodes_cache
 
     def set_text_node_by_pattern(
             self,
-            pattern: str,
+            pattern: Union[str, re.Pattern],
             ) -> Optional['XMLWrapper']:
         """
         Finds the first XML text node whose value matches the supplied regex pattern,
         and sets it as the current reference node within the wrapper.
 
         Parameters:
-          - pattern: The regex pattern to search for.
+          - pattern: The regex pattern to search for, as a str or compiled.
         Return: This object, ready to call additional methods; None on failure.
         """
-        r = re.compile(pattern)
-        try:
-            for n in self.node.getElementsByTagName(self.text_node_tag):
-                if n.firstChild.nodeType == n.TEXT_NODE \
-                        and r.search(n.firstChild.nodeValue):
-                            self.node = n
-                            return self
-        except:
-            return None
+        r = pattern if isinstance(pattern, re.Pattern) else _compile(pattern)
+        for n, text in self._text_nodes():
+            if r.search(text):
+                self.node = n
+                return self
+        return None
+
+    def set_text_ancestor_node_by_pattern(
+            self,
+            pattern: Union[str, re.Pattern],
+            tag_name: str,
+            ) -> Optional['XMLWrapper']:
+        """
+        Finds the first XML text node whose value matches the supplied regex pattern,
+        and sets its first ancestor which matches the supplied tag name as the
+        current reference node. Equivalent to set_text_node_by_pattern followed by
+        set_ancestor_node_by_tag, but done in one call and leaving the current
+        node unchanged on failure.
+
+        Parameters:
+          - pattern: The regex pattern to search for, as a str or compiled.
+          - tag_name: The XML tag name of the ancestor to search for.
+        Return: This object, ready to call additional methods; None on failure.
+        """
+        r = pattern if isinstance(pattern, re.Pattern) else _compile(pattern)
+        for n, text in self._text_nodes():
+            if r.search(text):
+                n = _find_ancestor(n, tag_name)
+                if n is None:
+                    return None
+                self.node = n
+                return self
+        return None
+
+    def get_text_nodes_by_pattern(
+            self,
+            pattern: Union[str, re.Pattern],
+            ) -> Dict[str, minidom.Node]:
+        """
+        Scans the XML text nodes below the current node once, looking for several
+        things at the same time. The pattern should be an alternation of named
+        groups, one per thing being searched for; the first text node matching
+        each group is recorded. The current node is not changed, but any of the
+        found nodes can be passed to set_node to continue from there.
+
+        Parameters:
+          - pattern: The regex pattern to search for, made up of named groups, as
+            a str or compiled.
+        Return: A dict with the names of the matched groups as keys and their
+        first matching text nodes as values; empty if nothing matched.
+        """
+        r = pattern if isinstance(pattern, re.Pattern) else _compile(pattern)
+        found = {}
+        for n, text in self._text_nodes():
+            m = r.search(text)
+            if m and m.lastgroup not in found:
+                found[m.lastgroup] = n
+                if len(found) == len(r.groupindex): #Found everything.
+                    break
+        return found
+
+    def get_text_nodes_by_patterns(
+            self,
+            patterns: Dict[str, str],
+            ) -> Dict[str, minidom.Node]:
+        """
+        Like get_text_nodes_by_pattern, but the patterns are given separately and
+        each is matched independently, so a text node matching several of them
+        is recorded for all of them. The text nodes are still only scanned once,
+        and a single alternation of all the patterns is used to cheaply skip
+        text nodes which match none of them. The patterns must not contain
+        numbered backreferences or group names of their own.
+
+        Parameters:
+          - patterns: A dict with names (valid Python identifiers) as keys and
+            the regex patterns to search for as values.
+        Return: A dict with the names of the matched patterns as keys and their
+        first matching text nodes as values; empty if nothing matched.
+
+        Example:
+          >>> x = XMLWrapper(
+          ...         '<w:d xmlns:w="w"><w:t>Quality Manager</w:t>'
+          ...         '<w:t>Manager</w:t></w:d>'
+          ...         )
+          >>> found = x.get_text_nodes_by_patterns(
+          ...         {'quality': 'Quality', 'manager': 'Manager'}
+          ...         )
+          >>> {k: x.set_node(n).get_text_value() for k, n in found.items()}
+          {'quality': 'Quality Manager', 'manager': 'Quality Manager'}
+        """
+        any_match = _compile(
+                '|'.join(f'(?P<{k}>{v})' for k, v in patterns.items())
+                )
+        pending = {k: _compile(v) for k, v in patterns.items()}
+        found = {}
+        for n, text in self._text_nodes():
+            if not any_match.search(text):
+                continue
+            for k, r in list(pending.items()):
+                if r.search(text):
+                    found[k] = n
+                    del pending[k]
+            if not pending: #Found everything.
+                break
+        return found
 
     def set_ancestor_node_by_tag(
             self,
@@ -176,42 +452,174 @@ class XMLWrapper:
           - tag_name: The XML tag name to search for.
         Return: This object, ready to call additional methods; None on failure.
         """
-        try:
-            n = self.node
-            while n.parentNode is not None:
-                n = n.parentNode
-                if n.tagName == tag_name:
-                    self.node = n
-                    return self
-            return None
-        except:
+        n = _find_ancestor(self.node, tag_name)
+        if n is None:
             return None
+        self.node = n
+        return self
 
     def get_text_value(
             self,
             start_node: minidom.Node = None,
-            ) -> Optional[str]:
+            ) -> str:
         """
         Returns a compilation of all text values found within the XML DOM.
+        Results for larger subtrees are remembered, since the DOM isn't modified.
 
         Parameters:
-          - start_node: The node to start at; used for recursion.
-        Return: The found string; None on failure.
-        """
-        try:
-            found_text = ''
-            if not start_node:
-                start_node = self.node
-            for n in start_node.childNodes:
-                if n.nodeType == n.TEXT_NODE: #Node is text
-                    found_text += n.nodeValue
-                elif n.tagName in self.special_tags: #Tag has special meaning
-                    if callable(self.special_tags[n.tagName]):
-                        found_text += self.special_tags[n.tagName](n)
-                    else:
-                        found_text += self.special_tags[n.tagName]
-                else: #Descend into the child node.
-                    found_text += self.get_text_value(n)
-            return found_text
-        except:
-            return None
+          - start_node: Optional. The node to start at; defaults to the current
+            node.
+        Return: The found string.
+        """
+        if not start_node:
+            start_node = self.node
+        cached = self._text_cache.get(start_node)
+        if cached is not None:
+            return cached
+        found_text = []
+        visited = 0
+        special_tags = self.special_tags
+        #Walk the subtree in document order with an explicit stack (children
+        #pushed in reverse), rather than recursing per descent.
+        stack = start_node.childNodes[::-1]
+        while stack:
+            n = stack.pop()
+            visited += 1
+            node_type = n.nodeType
+            if node_type == _TEXT_NODE or node_type == _CDATA_SECTION_NODE:
+                found_text.append(n.nodeValue)
+            elif node_type == _ELEMENT_NODE:
+                special = special_tags.get(n.tagName)
+                if special is None: #Descend into the child node.
+                    stack.extend(reversed(n.childNodes))
+                elif callable(special): #Tag has special meaning
+                    found_text.append(special(n))
+                else:
+                    found_text.append(special)
+            #Anything else (comments, processing instructions) holds no text.
+        found_text = ''.join(found_text)
+        if visited > _TEXT_CACHE_MIN_NODES: #Only worth remembering big subtrees.
+            self._text_cache[start_node] = found_text
+        return found_text
+
+
+def _iter_tag(
+        node: minidom.Node,
+        tag_name: str,
+        ) -> Generator[minidom.Element, None, None]:
+    """
+    Finds the descendants of a node with the given tag name, in document order.
+    Unlike getElementsByTagName, they are found lazily rather than collected
+    into a list up front, so searches which stop at the first match only walk
+    as far as that match.
+
+    Parameters:
+      - node: The node whose descendants are to be searched.
+      - tag_name: The XML tag name to search for.
+    Return: Generator, each iteration yielding a matching element.
+    """
+    stack = node.childNodes[::-1]
+    while stack:
+        n = stack.pop()
+        if n.nodeType == _ELEMENT_NODE:
+            if n.tagName == tag_name:
+                yield n
+            stack.extend(reversed(n.childNodes))
+
+
+def _find_ancestor(
+        node: minidom.Node,
+        tag_name: str,
+        ) -> Optional[minidom.Element]:
+    """
+    Finds the nearest ancestor of a node (not the node itself) with the given
+    tag name. The climb ends at the Document, which has no tag name.
+
+    Parameters:
+      - node: The node to start from.
+      - tag_name: The XML tag name to search for.
+    Return: The matching ancestor; None if there isn't one.
+    """
+    n = node.parentNode
+    while n is not None:
+        if getattr(n, 'tagName', None) == tag_name:
+            return n
+        n = n.parentNode
+    return None
+
+
+def _iter_text_nodes(
+        node: minidom.Node,
+        text_node_tag: str,
+        ) -> Generator[Tuple[minidom.Element, str], None, None]:
+    """
+    Finds the XML text nodes below a node which actually contain text (e.g.
+    skipping an empty <w:t/>), in document order.
+
+    Parameters:
+      - node: The node whose descendants are to be searched.
+      - text_node_tag: The XML tag name for nodes expected to contain text.
+    Return: Generator, each iteration yielding a (text node, its text) tuple.
+    """
+    for n in _iter_tag(node, text_node_tag):
+        text = n.firstChild
+        if text is not None and text.nodeType == _TEXT_NODE:
+            yield n, text.nodeValue
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(
+        pattern: str,
+        ) -> re.Pattern:
+    """
+    Compiles a regex pattern, caching the result so that searching many
+    documents with the same patterns only compiles each of them once.
+
+    Parameters:
+      - pattern: The regex pattern to compile.
+    Return: The compiled pattern.
+    """
+    return re.compile(pattern)
+
+
+def _builder(
+        ignore_tags: Optional[Iterable[str]] = None,
+        ) -> expatbuilder.ExpatBuilderNS:
+    """
+    Creates the (namespace-aware) builder used by minidom.parse/parseString,
+    adding a filter for any tags to be ignored.
+
+    Parameters:
+      - ignore_tags: Optional. See XMLWrapper.
+    Return: The builder, ready for parseString or parseFile.
+    """
+    options = xmlbuilder.Options()
+    if ignore_tags:
+        options.filter = _IgnoreTagsFilter(ignore_tags)
+    return expatbuilder.ExpatBuilderNS(options)
+
+
+class _IgnoreTagsFilter(xmlbuilder.DOMBuilderFilter):
+    """
+    A DOMBuilderFilter which rejects elements (and their descendants) by tag
+    name as soon as each one has been parsed.
+
+    Init parameters:
+      - ignore_tags: The XML tag names to be rejected.
+    """
+
+    whatToShow = NodeFilter.NodeFilter.SHOW_ELEMENT
+
+    def __init__(
+            self,
+            ignore_tags: Iterable[str],
+            ):
+        self.ignore_tags = frozenset(ignore_tags)
+
+    def acceptNode(
+            self,
+            node: minidom.Element,
+            ) -> int:
+        if node.tagName in self.ignore_tags:
+            return self.FILTER_REJECT
+        return self.FILTER_ACCEPT